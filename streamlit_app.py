@@ -7,17 +7,23 @@ Repository: https://github.com/Cs944612/NeuroChatAI
 """
 
 import streamlit as st
-import requests
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import httpx
+import asyncio
+import threading
+from collections import OrderedDict, deque
 from typing import Dict, List, Optional
 import time
-from datetime import datetime
+import hashlib
+import html
+import re
+from itertools import islice
 import logging
-import json
-from dotenv import load_dotenv    
+import orjson
+from dotenv import load_dotenv
 import os
-
-# Load environment variables
-load_dotenv()
+from types import MappingProxyType, SimpleNamespace
+from urllib.parse import urlsplit
 
 # Application Constants
 APP_VERSION = "1.0.0"
@@ -26,11 +32,78 @@ GITHUB_REPO = "https://github.com/Cs944612/NeuroChatAI"
 CREATED_DATE = "2025-01-22 16:10:37 UTC"
 AUTHOR = "Cs944612"
 
-# Enhanced Constants
-DEFAULT_API_URL = os.getenv("API_URL", "http://127.0.0.1:1234/v1/completions")
-DEFAULT_MODEL_NAME = os.getenv("MODEL_NAME", "your-model-name")
-MAX_HISTORY_MESSAGES = int(os.getenv("MAX_HISTORY_MESSAGES", "5"))
-RATE_LIMIT_SECONDS = float(os.getenv("RATE_LIMIT_SECONDS", "1.0"))
+@st.cache_resource(show_spinner=False)
+def _bootstrap() -> SimpleNamespace:
+    """
+    Load environment configuration and set up logging once per process
+
+    Runs under st.cache_resource so .env is read from disk and the root
+    logger configured a single time, not on every Streamlit rerun.
+
+    Returns:
+        SimpleNamespace: The resolved configuration values
+    """
+    load_dotenv()
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    max_history = int(os.getenv("MAX_HISTORY_MESSAGES", "5"))
+    return SimpleNamespace(
+        api_url=os.getenv("API_URL", "http://127.0.0.1:1234/v1/completions"),
+        model_name=os.getenv("MODEL_NAME", "your-model-name"),
+        max_history=max_history,
+        rate_limit=float(os.getenv("RATE_LIMIT_SECONDS", "1.0")),
+        # History bounds: once the transcript grows past summary_trigger
+        # messages, the oldest summary_batch are folded into a running
+        # summary instead of being kept verbatim
+        summary_trigger=6 * max_history,
+        summary_batch=2 * max_history
+    )
+
+_cfg = _bootstrap()
+
+MAX_STORED_MESSAGES = 200
+SUMMARY_MAX_TOKENS = 200
+
+# Completion-cache bounds: entries expire after an hour and the least
+# recently used are evicted past the size cap, so cached generations
+# don't accumulate for the life of the process
+RESPONSE_CACHE_TTL = 3600
+RESPONSE_CACHE_MAX_ENTRIES = 256
+
+# Client-side prompt budget: a rough 4-chars-per-token estimate against
+# the model context window, so oversized histories are trimmed before
+# they cross the socket instead of being tokenized and dropped server-side
+CTX_WINDOW_TOKENS = 4096
+CHARS_PER_TOKEN = 4
+
+# Micro-batching: concurrent non-streaming completions arriving within
+# this window are coalesced into one POST with a prompt list, so a
+# multi-session deployment lets the backend batch instead of serving
+# one sequence at a time
+BATCH_WINDOW_SECONDS = 0.02
+MAX_BATCH_SIZE = 8
+
+# Fast-path check for well-formed http(s) URLs; odd cases fall back to
+# a full urlsplit
+_URL_RE = re.compile(r"^https?://[^\s/]+")
+
+# Transcript styling for the single-markdown chat renderer
+_CHAT_CSS = """<style>
+.chat-msg { padding: 0.5em 0.75em; border-radius: 0.5em; margin: 0.25em 0; }
+.chat-user { background: rgba(28, 131, 225, 0.1); }
+.chat-assistant { background: rgba(128, 128, 128, 0.1); }
+</style>"""
+
+# Static UI strings, built once at import instead of per rerun
+_APP_INFO_MD = f"**{APP_NAME}** v{APP_VERSION}"
+_REPO_MD = f"[GitHub Repository]({GITHUB_REPO})"
+_WELCOME_MD = (
+    "Welcome to NeuroChatAI! This interface allows you to interact "
+    "with your local language model.\n"
+    "Configure your settings in the sidebar and start chatting below."
+)
 
 # Predefined Prompts
 PREDEFINED_PROMPTS = [
@@ -41,17 +114,220 @@ PREDEFINED_PROMPTS = [
     "Generate a creative story about AI and humans working together.",
 ]
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 class APIError(Exception):
     """Custom exception for API-related errors"""
     pass
 
+# Timeouts split into (connect, read) so a dead endpoint fails fast
+# while long generations are still allowed to complete
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 30
+STREAM_READ_TIMEOUT = 300
+
+# Invariant request fields, frozen so the stop sequences are
+# byte-identical across requests and server-side prompt-cache lookups
+# never miss on parameter drift
+_BASE_PAYLOAD = MappingProxyType({
+    "stop": ("\nHuman:", "\n\nHuman:", "\nSystem:"),
+    "cache_prompt": True
+})
+
+@st.cache_resource(show_spinner=False)
+def get_http_client() -> httpx.Client:
+    """
+    Create the shared synchronous HTTP client
+
+    Cached across Streamlit reruns so keep-alive connections survive
+    widget interactions instead of paying a new TCP handshake per
+    request; even on loopback this matters because reruns spawn many
+    short-lived request attempts. HTTP/2 lets a streamed completion and
+    a concurrent health probe share one socket, and the transport
+    retries failed connection attempts.
+
+    Returns:
+        httpx.Client: The configured client
+    """
+    return httpx.Client(
+        headers={"Content-Type": "application/json"},
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        transport=httpx.HTTPTransport(
+            http2=True,
+            retries=3,
+            limits=httpx.Limits(
+                max_connections=16,
+                max_keepalive_connections=8,
+                keepalive_expiry=60.0
+            )
+        )
+    )
+
+@st.cache_resource(show_spinner=False)
+def _get_async_runtime() -> tuple:
+    """
+    Create the shared background event loop and async HTTP client
+
+    The loop runs on a daemon thread so auxiliary calls (history
+    summarization, health probes) can overlap the main completion
+    instead of queueing behind it. The httpx client keeps its own
+    connection pool and, with HTTP/2, can multiplex concurrent calls
+    over a single socket.
+
+    Returns:
+        tuple: (event loop, httpx.AsyncClient)
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def _make_client() -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=20,
+                max_keepalive_connections=10
+            ),
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+        )
+
+    client = asyncio.run_coroutine_threadsafe(_make_client(), loop).result()
+    return loop, client
+
+def _run_async(coro):
+    """
+    Schedule a coroutine on the background loop
+
+    Args:
+        coro: The coroutine to run
+
+    Returns:
+        concurrent.futures.Future: Future resolving to the result
+    """
+    loop, _ = _get_async_runtime()
+    return asyncio.run_coroutine_threadsafe(coro, loop)
+
+async def _post_raw(api_url: str, payload: Dict) -> Optional[Dict]:
+    """
+    POST a single request on the async client
+
+    Args:
+        api_url (str): The API endpoint URL
+        payload (Dict): The request payload
+
+    Returns:
+        Optional[Dict]: The decoded response, or None on failure
+    """
+    _, client = _get_async_runtime()
+    try:
+        response = await client.post(
+            api_url,
+            content=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"}
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
+    except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+        logger.error("Async API request failed: %s", e)
+        return None
+
+class _CompletionBatcher:
+    """
+    Coalesce concurrent non-streaming completion requests
+
+    Requests arriving within BATCH_WINDOW_SECONDS that share the same
+    endpoint and sampling parameters are merged into one POST with a
+    prompt list (supported by vLLM and llama.cpp /v1/completions), so
+    the backend can batch sequences instead of serving them one at a
+    time. A lone request at window close falls back to a plain
+    single-prompt POST. Runs entirely on the background loop.
+    """
+
+    def __init__(self):
+        self._queue = asyncio.Queue()
+        self._drain_task = None
+
+    async def submit(self, api_url: str, payload: Dict) -> Optional[Dict]:
+        """
+        Queue a completion request and wait for its response
+
+        Args:
+            api_url (str): The API endpoint URL
+            payload (Dict): The request payload
+
+        Returns:
+            Optional[Dict]: The (per-prompt) response, or None on failure
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((api_url, payload, future))
+        if self._drain_task is None or self._drain_task.done():
+            self._drain_task = asyncio.ensure_future(self._drain())
+        return await future
+
+    @staticmethod
+    def _group_key(api_url: str, payload: Dict) -> str:
+        rest = {k: v for k, v in payload.items() if k != "prompt"}
+        return api_url + orjson.dumps(rest, option=orjson.OPT_SORT_KEYS).decode()
+
+    async def _drain(self) -> None:
+        while not self._queue.empty():
+            entries = [await self._queue.get()]
+            deadline = asyncio.get_running_loop().time() + BATCH_WINDOW_SECONDS
+            while len(entries) < MAX_BATCH_SIZE:
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    break
+                try:
+                    entries.append(
+                        await asyncio.wait_for(self._queue.get(), remaining)
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            groups: Dict[str, list] = {}
+            for entry in entries:
+                groups.setdefault(self._group_key(entry[0], entry[1]), []).append(entry)
+            for group in groups.values():
+                await self._send_group(group)
+
+    async def _send_group(self, group: list) -> None:
+        api_url, payload, future = group[0]
+        if len(group) == 1:
+            future.set_result(await _post_raw(api_url, payload))
+            return
+
+        batched = {**payload, "prompt": [entry[1]["prompt"] for entry in group]}
+        data = await _post_raw(api_url, batched)
+        choices = data.get("choices", []) if data else []
+        by_index = {c.get("index", i): c for i, c in enumerate(choices)}
+        for i, (_, _, fut) in enumerate(group):
+            choice = by_index.get(i)
+            fut.set_result({**data, "choices": [choice]} if choice else None)
+
+@st.cache_resource(show_spinner=False)
+def _get_batcher() -> _CompletionBatcher:
+    """
+    Return the shared completion batcher
+
+    Returns:
+        _CompletionBatcher: One batcher per server process
+    """
+    return _CompletionBatcher()
+
+async def _post_completion(api_url: str, payload: Dict) -> Optional[Dict]:
+    """
+    POST a non-streaming completion request via the batcher
+
+    Args:
+        api_url (str): The API endpoint URL
+        payload (Dict): The request payload
+
+    Returns:
+        Optional[Dict]: The decoded response, or None on failure
+    """
+    return await _get_batcher().submit(api_url, payload)
+
+@st.cache_data(show_spinner=False)
 def get_app_info() -> Dict[str, str]:
     """Return application information"""
     return {
@@ -65,127 +341,436 @@ def get_app_info() -> Dict[str, str]:
 def initialize_session_state() -> None:
     """Initialize the session state variables"""
     default_states = {
-        "messages": [],
+        "messages": deque(maxlen=MAX_STORED_MESSAGES),
+        "summary": "",
+        "_messages_version": 0,
+        "_chat_html": "",
         "api_health": True,
         "last_api_check": None,
-        "system_prompt": """You are a helpful AI assistant. 
+        "system_prompt": """You are a helpful AI assistant.
         You provide clear, accurate, and concise responses while being friendly and professional.""",
-        "chat_style": "modern",
-        "last_request_time": 0
+        "chat_style": "modern"
     }
     
     for key, value in default_states.items():
         if key not in st.session_state:
             st.session_state[key] = value
 
+@st.cache_data(ttl=30, show_spinner=False)
 def check_api_health(api_url: str) -> bool:
     """
     Check if the API endpoint is accessible
-    
+
+    Cached for 30 seconds so Streamlit reruns probe the endpoint at
+    most twice a minute instead of once per widget interaction. The
+    probe goes to /health at the server root — api_url points at the
+    completions endpoint, so appending /health to it would 404 on
+    LM Studio and llama-server.
+
     Args:
         api_url (str): The API endpoint URL
-    
+
     Returns:
         bool: True if API is healthy, False otherwise
     """
+    parts = urlsplit(api_url)
     try:
-        response = requests.get(f"{api_url}/health", timeout=5)
+        response = get_http_client().get(
+            f"{parts.scheme}://{parts.netloc}/health",
+            timeout=httpx.Timeout(5, connect=CONNECT_TIMEOUT)
+        )
         return response.status_code == 200
-    except requests.exceptions.RequestException:
+    except httpx.HTTPError:
         return False
 
+@st.cache_data(ttl=60, show_spinner=False)
 def validate_api_url(api_url: str) -> bool:
     """
     Validate the format of the API URL
-    
+
     Args:
         api_url (str): The API URL to validate
-    
+
     Returns:
         bool: True if valid, False otherwise
     """
-    try:
-        result = requests.utils.urlparse(api_url)
-        return all([result.scheme, result.netloc])
-    except Exception:
-        return False
+    if _URL_RE.match(api_url):
+        return True
+    parts = urlsplit(api_url)
+    return bool(parts.scheme in ("http", "https") and parts.netloc)
 
+@st.fragment
 def display_chat_history() -> None:
-    """Display the chat history with improved formatting"""
+    """
+    Display the chat history with improved formatting
+
+    Runs as a fragment so sidebar interactions don't re-render the
+    whole transcript, and emits the entire history as a single
+    st.markdown call instead of one component per message; the live
+    turn still streams through st.chat_message in handle_user_input.
+    Content is escaped once at insertion time.
+    """
     st.write("### 💬 Chat")
-    for message in st.session_state["messages"]:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
+    if st.session_state["_chat_html"]:
+        st.markdown(
+            _CHAT_CSS + st.session_state["_chat_html"],
+            unsafe_allow_html=True
+        )
+
+@st.cache_resource(show_spinner=False)
+def _get_rate_buckets() -> Dict[str, float]:
+    """
+    Return the shared per-session rate-limit buckets
+
+    Kept in a process-wide resource rather than session state, so the
+    limiter survives session-state reinitialization.
+
+    Returns:
+        Dict[str, float]: Last-allowed monotonic timestamp per session
+    """
+    return {}
 
 def rate_limit_check() -> bool:
     """
     Implement basic rate limiting
-    
+
+    Uses time.monotonic() so the limiter is immune to wall-clock (NTP)
+    jumps, keyed on the Streamlit session id.
+
     Returns:
         bool: True if within rate limit, False otherwise
     """
-    current_time = time.time()
-    if current_time - st.session_state["last_request_time"] < RATE_LIMIT_SECONDS:
-        st.warning(f"Please wait {RATE_LIMIT_SECONDS} seconds between messages.")
+    ctx = get_script_run_ctx()
+    session_id = ctx.session_id if ctx else "_no_ctx"
+    buckets = _get_rate_buckets()
+    now = time.monotonic()
+    if now - buckets.get(session_id, float("-inf")) < _cfg.rate_limit:
+        st.warning(f"Please wait {_cfg.rate_limit} seconds between messages.")
         return False
-    
-    st.session_state["last_request_time"] = current_time
+
+    buckets[session_id] = now
     return True
 
-def send_request_to_model(api_url: str, payload: Dict) -> Optional[Dict]:
+def _extract_chunk_text(chunk: Dict) -> str:
     """
-    Send a request to the local model API with improved error handling
-    
+    Extract the generated text from a single streamed chunk
+
+    Handles both completion-style chunks (``choices[0]["text"]``) and
+    chat-style deltas (``choices[0]["delta"]["content"]``).
+
+    Args:
+        chunk (Dict): A decoded SSE chunk from the API
+
+    Returns:
+        str: The text fragment, or an empty string if absent
+    """
+    choices = chunk.get("choices")
+    if not choices:
+        return ""
+    choice = choices[0]
+    if "text" in choice:
+        return choice["text"] or ""
+    return choice.get("delta", {}).get("content") or ""
+
+def stream_model_response(api_url: str, payload: Dict):
+    """
+    Stream a response from the local model API token-by-token
+
+    Sends the request with ``"stream": true`` and yields text fragments
+    as the server emits SSE chunks, so the first token renders as soon
+    as it is generated instead of after the full completion.
+
     Args:
         api_url (str): The API endpoint URL
         payload (Dict): The request payload
-    
-    Returns:
-        Optional[Dict]: The API response or None if request fails
+
+    Yields:
+        str: Text fragments of the generated response
     """
+    payload = {**payload, "stream": True}
     try:
-        response = requests.post(
+        with get_http_client().stream(
+            "POST",
             api_url,
-            json=payload,
-            headers={"Content-Type": "application/json"},
-            timeout=30
-        )
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.Timeout:
+            content=orjson.dumps(payload),
+            timeout=httpx.Timeout(STREAM_READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                if line.startswith("data: "):
+                    line = line[len("data: "):]
+                if line.strip() == "[DONE]":
+                    break
+                try:
+                    chunk = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    logger.error("Failed to decode streamed chunk")
+                    continue
+                text = _extract_chunk_text(chunk)
+                if text:
+                    yield text
+    except httpx.TimeoutException:
         st.error("Request timed out. Please try again.")
         logger.error("API request timed out")
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         st.error(f"API Error: {str(e)}")
-        logger.error(f"API request failed: {str(e)}")
-    except json.JSONDecodeError:
-        st.error("Invalid response from API")
-        logger.error("Failed to decode API response")
-    return None
+        logger.error("API request failed: %s", e)
 
-def build_prompt_with_history(user_input: str) -> str:
+@st.cache_resource(show_spinner=False)
+def _get_response_cache() -> OrderedDict:
     """
-    Build a prompt including chat history with improved formatting
-    
+    Return the shared completion cache
+
+    Maps a prompt-state hash to (expiry, generated text), so repeated
+    identical prompts (e.g. the predefined quick prompts) skip the
+    network and model entirely. Access goes through
+    _response_cache_get/_response_cache_put, which enforce the TTL and
+    LRU size cap.
+
+    Returns:
+        OrderedDict: The cache, shared across sessions and reruns
+    """
+    return OrderedDict()
+
+def _response_cache_get(key: str) -> Optional[str]:
+    """
+    Look up a cached completion, honoring the TTL
+
+    Args:
+        key (str): The prompt-state hash
+
+    Returns:
+        Optional[str]: The cached text, or None if absent or expired
+    """
+    cache = _get_response_cache()
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    expires, text = entry
+    if time.monotonic() > expires:
+        del cache[key]
+        return None
+    cache.move_to_end(key)
+    return text
+
+def _response_cache_put(key: str, text: str) -> None:
+    """
+    Store a completion, evicting the least recently used past the cap
+
+    Args:
+        key (str): The prompt-state hash
+        text (str): The generated text to cache
+    """
+    cache = _get_response_cache()
+    cache[key] = (time.monotonic() + RESPONSE_CACHE_TTL, text)
+    cache.move_to_end(key)
+    while len(cache) > RESPONSE_CACHE_MAX_ENTRIES:
+        cache.popitem(last=False)
+
+def _completion_cache_key(
+    user_input: str,
+    model_name: str,
+    temperature: float,
+    max_tokens: int
+) -> str:
+    """
+    Build a stable cache key for a completion request
+
+    Hashes the system prompt, the history window, the user input and the
+    sampling parameters, so any change to the effective prompt or the
+    generation settings yields a different key.
+
     Args:
         user_input (str): The user's input message
-    
+        model_name (str): The name of the model
+        temperature (float): The temperature parameter for generation
+        max_tokens (int): Maximum number of tokens to generate
+
+    Returns:
+        str: A hex digest identifying this request
+    """
+    state = {
+        "sp": st.session_state.get("system_prompt", ""),
+        "sum": st.session_state.get("summary", ""),
+        "hist": list(st.session_state["messages"])[-_cfg.max_history:],
+        "u": user_input,
+        "m": model_name,
+        "t": temperature,
+        "mt": max_tokens
+    }
+    serialized = orjson.dumps(state, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(serialized, digest_size=16).hexdigest()
+
+# Precomputed prompt fragments, so per-turn rendering is a single
+# string concatenation and the suffix never drifts
+_ROLE_TAGS = {"user": "Human:", "assistant": "Assistant:"}
+_ASSISTANT_SUFFIX = "\nAssistant:"
+
+def _render_turn(role: str, content: str) -> str:
+    """
+    Render a single chat turn into its prompt form
+
+    Each turn is rendered exactly once and reused verbatim afterwards,
+    so the prompt prefix stays byte-identical across requests and the
+    server-side KV cache remains valid for all but the new tokens.
+
+    Args:
+        role (str): The message role ("user" or "assistant")
+        content (str): The message content
+
+    Returns:
+        str: The rendered turn, with a leading newline
+    """
+    return f"\n{_ROLE_TAGS[role]} {content}"
+
+def _get_prompt_prefix() -> str:
+    """
+    Return the frozen system-prompt prefix
+
+    The prefix is rendered once and only refreshed when the system
+    prompt is explicitly updated, guaranteeing a byte-stable start of
+    every prompt.
+
+    Returns:
+        str: The rendered prefix, empty if no system prompt is set
+    """
+    if "_prompt_prefix" not in st.session_state:
+        system_prompt = st.session_state.get("system_prompt")
+        st.session_state["_prompt_prefix"] = (
+            f"System: {system_prompt}\n" if system_prompt else ""
+        )
+    return st.session_state["_prompt_prefix"]
+
+def begin_history_summarization(api_url: str, model_name: str):
+    """
+    Start folding the oldest messages into the conversation summary
+
+    When the transcript grows past summary_trigger messages, the oldest
+    summary_batch are sent to the model with a summarization
+    instruction. The request runs on the background loop so it overlaps
+    the main completion; finish_history_summarization applies the
+    result. Keeps both memory use and prompt length bounded while
+    preserving long-range context.
+
+    Args:
+        api_url (str): The API endpoint URL
+        model_name (str): The name of the model
+
+    Returns:
+        Optional[Future]: The in-flight request, or None if not due
+    """
+    messages = st.session_state["messages"]
+    if len(messages) < _cfg.summary_trigger:
+        return None
+
+    oldest = [messages[i] for i in range(_cfg.summary_batch)]
+    transcript = "".join(m["rendered"] for m in oldest).lstrip("\n")
+    previous = st.session_state.get("summary", "")
+    prompt = (
+        "Summarize the following conversation in a few sentences, "
+        "keeping any facts, names and decisions that later turns may "
+        "refer back to.\n"
+        + (f"Existing summary: {previous}\n" if previous else "")
+        + f"{transcript}\nSummary:"
+    )
+    payload = {
+        **_BASE_PAYLOAD,
+        "prompt": prompt,
+        "max_tokens": SUMMARY_MAX_TOKENS,
+        "temperature": 0,
+        "model": model_name
+    }
+    return _run_async(_post_completion(api_url, payload))
+
+def finish_history_summarization(future) -> None:
+    """
+    Apply a completed summarization request to session state
+
+    All session-state mutation happens here, on the script thread. On
+    failure the messages are kept and summarization is retried on a
+    later turn.
+
+    Args:
+        future: The future returned by begin_history_summarization
+    """
+    if future is None:
+        return
+    try:
+        data = future.result(timeout=READ_TIMEOUT)
+    except Exception as e:
+        logger.error("History summarization failed: %s", e)
+        return
+
+    if data and data.get("choices"):
+        st.session_state["summary"] = data["choices"][0]["text"].strip()
+        messages = st.session_state["messages"]
+        for _ in range(_cfg.summary_batch):
+            messages.popleft()
+        st.session_state["_chat_html"] = "".join(m["html"] for m in messages)
+        st.session_state["_messages_version"] += 1
+
+def _append_message(role: str, content: str) -> None:
+    """
+    Append a message to the chat history and its rendered prompt form
+
+    Args:
+        role (str): The message role ("user" or "assistant")
+        content (str): The message content
+    """
+    label = "You" if role == "user" else "AI"
+    escaped = html.escape(content).replace("\n", "<br>")
+    message_html = f'<div class="chat-msg chat-{role}"><b>{label}:</b> {escaped}</div>\n'
+    messages = st.session_state["messages"]
+    # A full ring buffer (e.g. when summarization keeps failing) drops
+    # its oldest entry on append, so the joined HTML must be rebuilt
+    # from the deque instead of growing past it
+    evicting = len(messages) == messages.maxlen
+    messages.append({
+        "role": role,
+        "content": content,
+        "rendered": _render_turn(role, content),
+        "html": message_html
+    })
+    if evicting:
+        st.session_state["_chat_html"] = "".join(m["html"] for m in messages)
+    else:
+        st.session_state["_chat_html"] += message_html
+    st.session_state["_messages_version"] += 1
+
+def build_prompt_with_history(user_input: str, max_tokens: int = 0) -> str:
+    """
+    Build a prompt including chat history with a byte-stable prefix
+
+    History turns are taken newest-first until either the history
+    window or the character budget derived from the context window is
+    exhausted, so the prompt never exceeds what the server would keep
+    after tokenization.
+
+    Args:
+        user_input (str): The user's input message
+        max_tokens (int): Tokens reserved for the generation
+
     Returns:
         str: The formatted prompt with history
     """
-    history = []
-    
-    # Add system prompt if exists
-    if st.session_state.get("system_prompt"):
-        history.append(f"System: {st.session_state['system_prompt']}\n")
-    
-    # Add recent message history
-    for msg in st.session_state["messages"][-MAX_HISTORY_MESSAGES:]:
-        role = "Human:" if msg["role"] == "user" else "Assistant:"
-        history.append(f"{role} {msg['content']}")
-    
-    history.append(f"Human: {user_input}")
-    return "\n".join(history) + "\nAssistant:"
+    prefix = _get_prompt_prefix()
+    summary = st.session_state.get("summary", "")
+    if summary:
+        prefix = prefix + f"Summary of earlier conversation: {summary}\n"
+
+    budget_chars = (CTX_WINDOW_TOKENS - max_tokens) * CHARS_PER_TOKEN
+    used = len(prefix) + len(user_input) + len(_ASSISTANT_SUFFIX) + len("\nHuman: ")
+    tail = []
+    for message in islice(reversed(st.session_state["messages"]), _cfg.max_history):
+        rendered = message["rendered"]
+        if used + len(rendered) > budget_chars:
+            break
+        tail.append(rendered)
+        used += len(rendered)
+    tail.reverse()
+    return prefix + "".join(tail) + f"\nHuman: {user_input}" + _ASSISTANT_SUFFIX
 
 def handle_user_input(
     user_input: str,
@@ -211,147 +796,236 @@ def handle_user_input(
         st.warning("Please enter a non-empty message.")
         return
 
-    # Add user input to chat history
-    st.session_state["messages"].append({"role": "user", "content": user_input})
-    
     with st.chat_message("user"):
         st.write(user_input)
 
-    with st.spinner("Thinking..."):
-        prompt = build_prompt_with_history(user_input)
-        payload = {
-            "prompt": prompt,
-            "max_tokens": max_tokens,
-            "temperature": temperature,
-            "model": model_name,
-            "stop": ["\nHuman:", "\n\nHuman:", "\nSystem:"]
-        }
-
-        response = send_request_to_model(api_url, payload)
-        
-        if response and "choices" in response and response["choices"]:
-            ai_message = response["choices"][0]["text"].strip()
-            st.session_state["messages"].append({"role": "assistant", "content": ai_message})
-            
+    # Kick off summarization in the background; it only touches turns
+    # outside the history window, so it can overlap the completion
+    summary_future = begin_history_summarization(api_url, model_name)
+
+    # Only deterministic generations are safe to reuse across requests
+    cache_key = None
+    if temperature == 0:
+        cache_key = _completion_cache_key(
+            user_input, model_name, temperature, max_tokens
+        )
+        cached = _response_cache_get(cache_key)
+        if cached is not None:
+            _append_message("user", user_input)
+            _append_message("assistant", cached)
             with st.chat_message("assistant"):
-                st.write(ai_message)
-        else:
-            st.error("Failed to get a valid response from the model.")
+                st.write(cached)
+            finish_history_summarization(summary_future)
+            return
+
+    # Build the prompt before recording the new turn, so the rendered
+    # history tail stays a verbatim prefix of this prompt
+    prompt = build_prompt_with_history(user_input, max_tokens)
+    _append_message("user", user_input)
+    payload = {
+        **_BASE_PAYLOAD,
+        "prompt": prompt,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "model": model_name
+    }
+
+    with st.chat_message("assistant"):
+        ai_message = st.write_stream(stream_model_response(api_url, payload))
+
+    if ai_message:
+        ai_message = ai_message.strip()
+        _append_message("assistant", ai_message)
+        if cache_key is not None:
+            _response_cache_put(cache_key, ai_message)
+    else:
+        st.error("Failed to get a valid response from the model.")
+
+    finish_history_summarization(summary_future)
+
+@st.cache_data(max_entries=16, ttl=3600, show_spinner=False)
+def _serialize_chat_export(session_id: str, messages_version: int) -> tuple:
+    """
+    Serialize the chat history for download
+
+    Keyed on the session id plus the transcript version counter:
+    st.cache_data is shared across sessions, so the session id keeps
+    each entry private to its own conversation, while the version
+    counter means the O(N) serialization only runs when messages
+    actually change instead of on every rerun while the download
+    button is visible. Bounded by max_entries and a TTL — the key
+    changes with every turn, so entries for old versions are dead
+    weight and must not accumulate for the life of the process.
+
+    Args:
+        session_id (str): The Streamlit session id
+        messages_version (int): Current value of _messages_version
+
+    Returns:
+        tuple: (filename, serialized bytes)
+    """
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
+    chat_data = {
+        "app_info": get_app_info(),
+        "timestamp": timestamp,
+        "messages": [
+            {"role": m["role"], "content": m["content"]}
+            for m in st.session_state["messages"]
+        ],
+        "summary": st.session_state.get("summary", ""),
+        "system_prompt": st.session_state.get("system_prompt", "")
+    }
+    filename = f"chat_history_{timestamp}.json"
+    return filename, orjson.dumps(chat_data, option=orjson.OPT_INDENT_2)
 
 def export_chat_history() -> None:
     """Export chat history to a JSON file"""
     if st.session_state["messages"]:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"chat_history_{timestamp}.json"
-        chat_data = {
-            "app_info": get_app_info(),
-            "timestamp": timestamp,
-            "messages": st.session_state["messages"],
-            "system_prompt": st.session_state.get("system_prompt", "")
-        }
-        st.download_button(
-            label="📤 Export Chat",
-            data=json.dumps(chat_data, indent=2),
-            file_name=filename,
-            mime="application/json"
-        )
+        with st.expander("📤 Export"):
+            ctx = get_script_run_ctx()
+            filename, data = _serialize_chat_export(
+                ctx.session_id if ctx else "_no_ctx",
+                st.session_state["_messages_version"]
+            )
+            st.download_button(
+                label="📤 Export Chat",
+                data=data,
+                file_name=filename,
+                mime="application/json"
+            )
+
+@st.fragment
+def _prompts_fragment() -> None:
+    """
+    Render the predefined quick-prompt buttons
+
+    Runs as a fragment so a button click only reruns this scope; the
+    chosen prompt is queued in session state and handled by main()
+    after a full rerun, so the reply renders in the chat area.
+    """
+    st.header("💡 Quick Prompts")
+    for prompt in PREDEFINED_PROMPTS:
+        if st.button(prompt):
+            st.session_state["_queued_prompt"] = prompt
+            st.rerun(scope="app")
 
 def sidebar_settings() -> tuple:
     """
     Display and handle sidebar settings with validation
-    
+
+    The settings widgets live in a form so typing doesn't trigger a
+    full script rerun per keystroke; values only take effect on Apply.
+
     Returns:
         tuple: (api_url, model_name, temperature, max_tokens)
     """
     with st.sidebar:
         st.header("⚙️ Settings")
-        
-        # Add tabs for different settings categories
-        tab1, tab2, tab3 = st.tabs(["Model", "Chat", "System"])
-        
-        with tab1:
-            api_url = st.text_input(
-                "API Endpoint",
-                DEFAULT_API_URL,
-                help="The API endpoint for your local model."
-            )
-            
-            if not validate_api_url(api_url):
-                st.warning("Please enter a valid API URL")
-            
-            model_name = st.text_input(
-                "Model Name",
-                DEFAULT_MODEL_NAME,
-                help="The name of the model you're using."
-            )
-            
-            temperature = st.slider(
-                "Temperature",
-                min_value=0.0,
-                max_value=1.0,
-                value=0.7,
-                step=0.1,
-                help="Controls the randomness of the model's responses."
-            )
-            
-            max_tokens = st.number_input(
-                "Max Tokens",
-                min_value=10,
-                max_value=4096,
-                value=512,
-                help="The maximum number of tokens to generate."
-            )
-        
-        with tab2:
-            st.number_input(
-                "Max History Messages",
-                min_value=1,
-                max_value=20,
-                value=MAX_HISTORY_MESSAGES,
-                help="Number of previous messages to include for context"
-            )
-            
-            st.number_input(
-                "Rate Limit (seconds)",
-                min_value=0.1,
-                max_value=5.0,
-                value=RATE_LIMIT_SECONDS,
-                step=0.1,
-                help="Minimum time between messages"
-            )
-        
-        with tab3:
-            system_prompt = st.text_area(
-                "System Prompt",
-                st.session_state.get("system_prompt", ""),
-                help="Define the AI assistant's behavior"
-            )
-            if st.button("Update System Prompt"):
+
+        with st.form("settings"):
+            # Add tabs for different settings categories
+            tab1, tab2, tab3 = st.tabs(["Model", "Chat", "System"])
+
+            with tab1:
+                api_url = st.text_input(
+                    "API Endpoint",
+                    _cfg.api_url,
+                    help="The API endpoint for your local model."
+                )
+
+                model_name = st.text_input(
+                    "Model Name",
+                    _cfg.model_name,
+                    help="The name of the model you're using."
+                )
+
+                temperature = st.slider(
+                    "Temperature",
+                    min_value=0.0,
+                    max_value=1.0,
+                    value=0.7,
+                    step=0.1,
+                    help="Controls the randomness of the model's responses."
+                )
+
+                max_tokens = st.number_input(
+                    "Max Tokens",
+                    min_value=10,
+                    max_value=4096,
+                    value=512,
+                    help="The maximum number of tokens to generate."
+                )
+
+            with tab2:
+                st.number_input(
+                    "Max History Messages",
+                    min_value=1,
+                    max_value=20,
+                    value=_cfg.max_history,
+                    help="Number of previous messages to include for context"
+                )
+
+                st.number_input(
+                    "Rate Limit (seconds)",
+                    min_value=0.1,
+                    max_value=5.0,
+                    value=_cfg.rate_limit,
+                    step=0.1,
+                    help="Minimum time between messages"
+                )
+
+            with tab3:
+                system_prompt = st.text_area(
+                    "System Prompt",
+                    st.session_state.get("system_prompt", ""),
+                    help="Define the AI assistant's behavior"
+                )
+
+            applied = st.form_submit_button("Apply Settings")
+
+        if applied:
+            if system_prompt != st.session_state.get("system_prompt"):
                 st.session_state["system_prompt"] = system_prompt
-                st.success("System prompt updated!")
+                st.session_state["_prompt_prefix"] = (
+                    f"System: {system_prompt}\n" if system_prompt else ""
+                )
+                # The export embeds the system prompt, so invalidate
+                # the cached serialization too
+                st.session_state["_messages_version"] += 1
+            st.success("Settings applied!")
+
+        if not validate_api_url(api_url):
+            st.warning("Please enter a valid API URL")
+        else:
+            # TTL-cached, so reruns reuse the last probe instead of
+            # adding a round-trip to every widget click
+            st.session_state["api_health"] = check_api_health(api_url)
+            if st.session_state["api_health"]:
+                st.caption("🟢 API reachable")
+            else:
+                st.caption("🔴 API unreachable")
 
         # Predefined prompts section
         st.markdown("---")
-        st.header("💡 Quick Prompts")
-        for prompt in PREDEFINED_PROMPTS:
-            if st.button(prompt):
-                handle_user_input(prompt, api_url, model_name, temperature, max_tokens)
+        _prompts_fragment()
 
         # App info and controls
         st.markdown("---")
         col1, col2 = st.columns(2)
         with col1:
             if st.button("🗑️ Reset Chat"):
-                st.session_state["messages"] = []
+                st.session_state["messages"].clear()
+                st.session_state["_chat_html"] = ""
+                st.session_state["summary"] = ""
+                st.session_state["_messages_version"] += 1
                 st.success("Chat history has been reset.")
         with col2:
             export_chat_history()
         
         # App information
         st.markdown("---")
-        app_info = get_app_info()
-        st.markdown(f"**{app_info['name']}** v{app_info['version']}")
-        st.markdown(f"[GitHub Repository]({app_info['repository']})")
+        st.markdown(_APP_INFO_MD)
+        st.markdown(_REPO_MD)
 
         return api_url, model_name, temperature, max_tokens
 
@@ -367,10 +1041,7 @@ def main():
         )
         
         st.title(f"🧠 {APP_NAME}")
-        st.markdown("""
-        Welcome to NeuroChatAI! This interface allows you to interact with your local language model.
-        Configure your settings in the sidebar and start chatting below.
-        """)
+        st.markdown(_WELCOME_MD)
 
         # Initialize session state
         initialize_session_state()
@@ -383,13 +1054,18 @@ def main():
         with chat_container:
             display_chat_history()
 
+        # Handle a quick prompt queued from the sidebar fragment
+        queued_prompt = st.session_state.pop("_queued_prompt", None)
+        if queued_prompt:
+            handle_user_input(queued_prompt, api_url, model_name, temperature, max_tokens)
+
         # Get and handle user input
         user_input = st.chat_input("Your message")
         if user_input:
             handle_user_input(user_input, api_url, model_name, temperature, max_tokens)
 
     except Exception as e:
-        logger.error(f"Application error: {str(e)}")
+        logger.error("Application error: %s", e)
         st.error("An unexpected error occurred. Please refresh the page and try again.")
 
 if __name__ == "__main__":